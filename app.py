@@ -1,6 +1,6 @@
 import streamlit as st
-import requests
-import base64
+import httpx
+import json
 from PIL import Image
 import io
 
@@ -9,6 +9,16 @@ API_URL = "https://traffic-vehile-identifier.onrender.com"
 
 st.set_page_config(page_title="Traffic Intel 🚦", layout="wide")
 
+# HTTP CLIENT (One pooled HTTP/2 connection shared across reruns)
+@st.cache_resource
+def get_client():
+    return httpx.Client(
+        base_url=API_URL,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+        timeout=30.0,
+    )
+
 # Custom CSS
 st.markdown("""
     <style>
@@ -16,6 +26,31 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+# MJPEG READER (Splits a "multipart/x-mixed-replace; boundary=frame" stream into (content type, body) parts)
+def iter_mjpeg_parts(res):
+    buf = b""
+    for chunk in res.iter_bytes(chunk_size=64 * 1024):
+        buf += chunk
+        while True:
+            body_start = buf.find(b"\r\n\r\n") # End of the part headers
+            next_part = buf.find(b"\r\n--frame\r\n", body_start + 4)
+            if body_start == -1 or next_part == -1:
+                break # Wait for more bytes
+            yield part_content_type(buf[:body_start]), buf[body_start + 4:next_part]
+            buf = buf[next_part + 2:]
+    # Last part has no boundary after it, just the closing CRLF
+    body_start = buf.find(b"\r\n\r\n")
+    if body_start != -1 and buf.endswith(b"\r\n"):
+        yield part_content_type(buf[:body_start]), buf[body_start + 4:-2]
+
+# Helper: Read "Content-Type: ..." out of a part's header block
+def part_content_type(header_block):
+    for line in header_block.decode("latin-1").split("\r\n"):
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-type":
+            return value.strip()
+    return "image/jpeg"
+
 # AUTH & SESSION SETUP
 if 'token' not in st.session_state: st.session_state.token = None
 if 'username' not in st.session_state: st.session_state.username = None
@@ -34,7 +69,7 @@ def login_page():
         if st.button("Login", type="primary"):
             try:
                 # Send credentials to FastAPI
-                res = requests.post(f"{API_URL}/login", json={"username": username, "password": password})
+                res = get_client().post("/login", json={"username": username, "password": password})
                 
                 if res.status_code == 200:
                     # Success! Save the token and reload the app
@@ -59,7 +94,7 @@ def login_page():
             else:
                 try:
                     # Send new user data to FastAPI
-                    res = requests.post(f"{API_URL}/register", json={"username": new_user, "password": new_pass})
+                    res = get_client().post("/register", json={"username": new_user, "password": new_pass})
                     
                     if res.status_code == 200:
                         st.balloons() # 🎉
@@ -95,25 +130,23 @@ def main_dashboard():
         uploaded_file = st.file_uploader("Upload Image", type=['jpg', 'png'])
         if uploaded_file and st.button("Analyze Photo"):
             with st.spinner("Detecting objects..."):
-                # OPTION 2 FIX: Explicitly setting MIME type
-                files = {"file": (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
+                # Send the raw image bytes as the body (MIME type in the header)
+                img_headers = {**headers, "Content-Type": uploaded_file.type}
                 params = {"conf": confidence} # Pass slider value
                 
                 try:
-                    res = requests.post(f"{API_URL}/predict/image", files=files, headers=headers, params=params)
+                    res = get_client().post("/predict/image", content=uploaded_file.getvalue(), headers=img_headers, params=params)
                     if res.status_code == 200:
-                        data = res.json()
-                        
-                        # Decode the Base64 image sent by backend
-                        img_data = base64.b64decode(data['annotated_image'])
-                        annotated_img = Image.open(io.BytesIO(img_data))
+                        # The body IS the annotated JPEG, stats come in the headers
+                        annotated_img = Image.open(io.BytesIO(res.content))
+                        breakdown = json.loads(res.headers['X-Breakdown'])
                         
                         col1, col2 = st.columns([2, 1])
                         with col1:
                             st.image(annotated_img, caption="AI Vision Overlay", use_container_width=True)
                         with col2:
-                            st.metric("Total Vehicles", data['total_vehicles'])
-                            st.json(data['breakdown'])
+                            st.metric("Total Vehicles", int(res.headers['X-Total-Vehicles']))
+                            st.json(breakdown)
                     else:
                         st.error(f"Error: {res.text}")
                 except Exception as e:
@@ -123,18 +156,30 @@ def main_dashboard():
     with tab_vid:
         video_file = st.file_uploader("Upload Video", type=['mp4'])
         if video_file and st.button("Process Video Overlay"):
-            st.warning("⏳ Processing video frames... This might take 10-20 seconds.")
+            st.info("⏳ Frames appear below as soon as the AI finishes them.")
             with st.spinner("AI is drawing bounding boxes..."):
                 files = {"file": ("video.mp4", video_file.getvalue(), "video/mp4")}
                 params = {"conf": confidence}
                 
                 try:
-                    res = requests.post(f"{API_URL}/predict/video", files=files, headers=headers, params=params)
-                    if res.status_code == 200:
-                        st.success("Processing Complete!")
-                        st.video(res.content) # Streamlit can play the bytes directly
-                    else:
-                        st.error(f"Server Error: {res.text}")
+                    # stream(): read frames as they arrive instead of waiting for the whole video
+                    # (longer read timeout: the first batch of frames can take a while on CPU)
+                    with get_client().stream("POST", "/predict/video/stream", files=files, headers=headers, params=params, timeout=httpx.Timeout(30.0, read=120.0)) as res:
+                        if res.status_code == 200:
+                            frame_slot = st.empty()
+                            summary = None
+                            for content_type, body in iter_mjpeg_parts(res):
+                                if content_type == "application/json":
+                                    summary = json.loads(body) # Sent once, after the last frame
+                                else:
+                                    frame_slot.image(body, caption="AI Vision Overlay", use_container_width=True)
+                            st.success("Processing Complete!")
+                            if summary:
+                                st.caption("Detections across analysed frames")
+                                st.json(summary['breakdown'])
+                        else:
+                            res.read() # Streamed responses must be read before .text
+                            st.error(f"Server Error: {res.text}")
                 except Exception as e:
                     st.error(f"Failed: {e}")
 
@@ -144,21 +189,18 @@ def main_dashboard():
         camera_img = st.camera_input("Capture Frame")
         
         if camera_img:
-            # OPTION 2 FIX APPLIED HERE TOO
-            files = {"file": ("live_capture.jpg", camera_img.getvalue(), "image/jpeg")}
+            # Raw JPEG bytes straight from the camera
+            img_headers = {**headers, "Content-Type": "image/jpeg"}
             params = {"conf": confidence}
             
             try:
-                res = requests.post(f"{API_URL}/predict/image", files=files, headers=headers, params=params)
+                res = get_client().post("/predict/image", content=camera_img.getvalue(), headers=img_headers, params=params)
                 if res.status_code == 200:
-                    data = res.json()
-                    
-                    # Display the Annotated Image
-                    img_data = base64.b64decode(data['annotated_image'])
-                    annotated_img = Image.open(io.BytesIO(img_data))
+                    # Display the Annotated Image (raw JPEG body)
+                    annotated_img = Image.open(io.BytesIO(res.content))
                     
                     st.image(annotated_img, caption="Live Analysis", use_container_width=True)
-                    st.metric("Count", data['total_vehicles'], delta=data['status'])
+                    st.metric("Count", int(res.headers['X-Total-Vehicles']), delta=json.loads(res.headers['X-Status']))
                 else:
                     st.error(f"Server rejected image: {res.text}")
             except Exception as e:
@@ -1,6 +1,10 @@
 # datetime: To calculate when the token expires (e.g., 30 mins from now).
 # timezone: To ensure we use universal time (UTC), not local time.
 from datetime import datetime, timedelta, timezone
+# time: Current time in seconds, to check expiry on cached tokens.
+import time
+# functools: lru_cache remembers results of a function call (our token decoder).
+import functools
 # Optional: Just a helper for typing (saying "this variable might be None").
 from typing import Optional
 # jwt: The library that creates the JWT (JSON Web Token).
@@ -11,6 +15,9 @@ import jwt
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
+# CryptContext: The "Password Blender". Turns passwords into hashes and checks them (in fast C code).
+# We need to install this: pip install "passlib[argon2]"
+from passlib.context import CryptContext
 
 # --- 1. CONFIGURATION (The Settings) ---
 # The Secret Key is used to "sign" the token. 
@@ -19,6 +26,9 @@ SECRET_KEY = 'super_secret_diabolical_key'
 ALGORITHM = 'HS256' # The math used to scramble the token.
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 # VIP badge is valid for 30 mins.
 
+# Created ONCE and reused for every login (argon2id = the current best-practice password hash).
+pwd_context = CryptContext(schemes=['argon2'], deprecated='auto')
+
 # The "Bouncer" at the door (professionally: "Dependency Injection"). It expects a header like: "Authorization: Bearer <token>"
 security = HTTPBearer()
 
@@ -29,7 +39,7 @@ security = HTTPBearer()
 fake_users_db = {
     'admin': {
         'username': 'admin',
-        'password': 'secretpassword',
+        'password': pwd_context.hash('secretpassword'), # Stored as a hash, never as plain text
         'disabled': False
     }
 }
@@ -68,6 +78,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     
     return encoded_jwt
 
+# FUNCTION B0: Decode the Token (with a memory)
+# The live feed sends the SAME token with every frame, so we remember decoded tokens
+# and skip the signature check on repeats. Fake/broken tokens raise, and errors are never cached.
+@functools.lru_cache(maxsize=1024)
+def decode_token(token: str) -> dict:
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
 # FUNCTION B: Verify the Token (The ID Checker)
 # This function is used by 'Depends'. It runs before the endpoint logic.
 def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
@@ -76,7 +93,11 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
     
     try:
         # 2. Decode it. If the SECRET_KEY doesn't match, this crashes.
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
+        
+        # A cached token skips jwt's own expiry check, so check 'exp' ourselves
+        if 'exp' in payload and payload['exp'] <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
         
         # 3. Get the username ('sub' stands for subject) from the token
         username: str = payload.get('sub')
@@ -100,10 +121,10 @@ def register_new_user(user: UserAuth):
     if user.username in fake_users_db:
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    # WARNING: In production, NEVER store plain passwords. Use Hashing!
+    # Only the hash is stored. Even we can't read the password back!
     fake_users_db[user.username] = {
         'username': user.username,
-        'password': user.password,  # Ideally: hash_password(user.password)
+        'password': pwd_context.hash(user.password),
         'disabled': False
     }
     return user
@@ -112,7 +133,9 @@ def register_new_user(user: UserAuth):
 def authenticate_user(user: UserAuth):
     db_user = fake_users_db.get(user.username)
     if not db_user:
+        # Hash anyway, so "no such user" takes as long as "wrong password" (no timing hints)
+        pwd_context.dummy_verify()
         return None # User not found
-    if db_user['password'] != user.password:
-        return None # Wrong password
+    if not pwd_context.verify(user.password, db_user['password']):
+        return None # Wrong password (compared in constant time)
     return db_user
\ No newline at end of file
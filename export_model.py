@@ -0,0 +1,27 @@
+import os
+import sys
+import torch
+from ultralytics import YOLO
+
+# One-time export of best.pt to a faster format. main.py picks it up automatically
+# and falls back to best.pt if it is missing.
+#   GPU server -> best.engine (TensorRT, FP16). Only works on the GPU + TensorRT version it was built with.
+#   CPU server -> best_int8_openvino_model/ (OpenVINO, INT8).
+
+# INT8 needs sample images to calibrate against: a dataset yaml pointing at OUR traffic images
+# (same classes as best.pt). Calibrating on anything else gives a quietly worse model.
+CALIB_DATA = 'calib.yaml'
+
+# The video pipeline sends several frames per model.predict() call, so exports must accept batches.
+# Keep this >= VIDEO_BATCH_SIZE in main.py.
+MAX_BATCH = 16
+
+if __name__ == "__main__":
+    model = YOLO('best.pt')
+    if torch.cuda.is_available():
+        model.export(format='engine', half=True, imgsz=640, device=0, dynamic=True, batch=MAX_BATCH)
+    else:
+        if not os.path.exists(CALIB_DATA):
+            sys.exit(f"⚠️ {CALIB_DATA} not found. INT8 export needs a dataset yaml of traffic images to calibrate on.")
+        path = model.export(format='openvino', int8=True, data=CALIB_DATA, imgsz=640, dynamic=True, batch=MAX_BATCH)
+        print(f"✅ Exported to {path} (main.py loads it from OPENVINO_PATH)")
@@ -2,14 +2,22 @@ import shutil
 import tempfile
 import cv2
 import os
-import base64
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Query
-from fastapi.responses import JSONResponse, FileResponse
+import json
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from ultralytics import YOLO
-from PIL import Image
-import io
 import numpy as np
-from collections import Counter
+import torch
+import asyncio
+import functools
+import uvicorn
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import av # PyAV: FFmpeg decoding with GPU (NVDEC) support. GPU hosts only: pip install av
+except ImportError:
+    av = None # Optional: videos are decoded with OpenCV instead
 from auth import verify_token, UserAuth, TokenResponse, register_new_user, authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 from datetime import timedelta
 
@@ -17,116 +25,375 @@ app = FastAPI(title="Traffic Intelligence API 🚦")
 
 # Load Model
 MODEL_PATH = 'best.pt'
+# Optional faster builds of best.pt (create them with: python export_model.py)
+ENGINE_PATH = 'best.engine' # GPU: TensorRT (must be exported with a dynamic batch: the video pipeline predicts in batches)
+OPENVINO_PATH = 'best_int8_openvino_model/' # CPU: OpenVINO INT8 (Ultralytics adds 'int8_' to the folder name)
 if not os.path.exists(MODEL_PATH):
     raise FileNotFoundError(f"⚠️ Model file not found at {MODEL_PATH}")
-model = YOLO(MODEL_PATH)
+
+# Prepare the model ONCE at startup (not on the first request)
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+HALF = DEVICE == 'cuda' # FP16 only pays off on GPU tensor cores
+
+if DEVICE == 'cuda' and os.path.exists(ENGINE_PATH):
+    # TensorRT engine: already fused, FP16 and tuned for this GPU
+    model = YOLO(ENGINE_PATH, task='detect')
+elif DEVICE == 'cpu' and os.path.exists(OPENVINO_PATH):
+    # INT8 weights: 4x smaller, uses the CPU's int8 dot-product instructions
+    model = YOLO(OPENVINO_PATH, task='detect')
+else:
+    model = YOLO(MODEL_PATH)
+    model.to(DEVICE)
+    model.fuse() # Merge Conv + BatchNorm layers -> fewer kernel launches
+
+# Input size the model was trained on (video frames are shrunk to this before inference)
+IMGSZ = 640
+# Uploaded videos go to /dev/shm (RAM-backed tmpfs) when it exists and has room, else the normal temp dir
+SPOOL_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# Frames per model.predict() call in /predict/video (lower it if the GPU runs out of memory).
+# Exported models only accept batches up to MAX_BATCH in export_model.py -> keep this <= that.
+VIDEO_BATCH_SIZE = 16
+# Run the model on every Nth video frame only (traffic barely moves in 1/10th of a second)
+VIDEO_FRAME_SKIP = 3
+
+# Warmup: pay the CUDA/cuDNN autotune cost now, not on the first user
+if DEVICE == 'cuda':
+    model.predict(np.zeros((IMGSZ, IMGSZ, 3), dtype=np.uint8), imgsz=IMGSZ, half=True, verbose=False)
+
+# ONE model in memory, shared by every request.
+# Run with a single worker (see bottom of file): every extra worker would load another copy into VRAM.
+# A single pool thread runs ALL inference: GPU work is serialised and the event loop stays free
+INFERENCE_POOL = ThreadPoolExecutor(max_workers=1)
+
+# Helper A: Run model.predict() from an async endpoint (awaits without blocking other requests)
+async def run_model(source, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(INFERENCE_POOL, functools.partial(model.predict, source, **kwargs))
+
+# Helper B: Same, but from a worker thread (the video pipeline)
+def run_model_sync(source, **kwargs):
+    return INFERENCE_POOL.submit(model.predict, source, **kwargs).result()
+
+# Helper C: Count detections per class -> array where index = class id (counted in C, not a Python loop)
+def count_classes(result):
+    cls = result.boxes.cls.cpu().numpy().astype(np.int64)
+    return np.bincount(cls, minlength=len(model.names))
+
+# Helper D: Turn a per-class count array into {"car": 3, "bus": 1} (classes with 0 are left out)
+def class_breakdown(counts):
+    names = model.names
+    return {names[i]: int(counts[i]) for i in np.nonzero(counts)[0]}
 
 # ---------------------------------------------------------
-# 📸 1. IMAGE PREDICTION (Returns Stats + Annotated Image)
+# 📸 1. IMAGE PREDICTION (Returns Annotated JPEG + Stats in Headers)
 # ---------------------------------------------------------
 @app.post('/predict/image')
 async def predict_image(
-    file: UploadFile = File(...), 
+    request: Request, # <--- Raw image bytes in the body (no multipart parsing)
     conf: float = Query(0.25, ge=0.0, le=1.0), # <--- Receive Confidence Slider Value
     username: str = Depends(verify_token)
 ):
-    try:
-        # Read Image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+    # Read Image (The whole body IS the image)
+    contents = await request.body()
+    if not contents:
+        raise HTTPException(status_code=400, detail="Request body must contain an image.")
+
+    # Decode straight to a BGR NumPy array (what YOLO and OpenCV both use)
+    image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise HTTPException(status_code=400, detail="Could not decode image.")
 
+    try:
         # Run YOLO with the user's confidence level
-        results = model.predict(image, conf=conf)
+        results = await run_model(image, conf=conf, half=HALF)
         result = results[0]
         
         # A. DRAW BOXES (The "Info Box" Overlay)
-        # plot() returns a NumPy array (BGR format)
+        # plot() returns a NumPy array (BGR format) -> encode it as JPEG as-is
         annotated_array = result.plot() 
-        # Convert BGR (OpenCV) to RGB (PIL)
-        annotated_image = Image.fromarray(cv2.cvtColor(annotated_array, cv2.COLOR_BGR2RGB))
-
-        # Encode image to Base64 string to send back to Streamlit
-        buf = io.BytesIO()
-        annotated_image.save(buf, format="JPEG")
-        img_str = base64.b64encode(buf.getvalue()).decode("utf-8")
+        ok, jpg = cv2.imencode('.jpg', annotated_array, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            raise RuntimeError("Could not encode annotated image.") # -> 500 below
 
         # B. COUNT VEHICLES
-        names = result.names
-        counts = Counter([names[int(c)] for c in result.boxes.cls.cpu().numpy()])
-        total = sum(counts.values())
-
-        return {
-            "total_vehicles": total,
-            "breakdown": dict(counts),
-            "status": "Congested 🚨" if total > 15 else "Clear ✅",
-            "annotated_image": img_str # <--- Sending the drawing back!
-        }
+        counts = count_classes(result)
+        breakdown = class_breakdown(counts)
+        total = int(counts.sum())
+        status = "Congested 🚨" if total > 15 else "Clear ✅"
+
+        # Body = the JPEG itself (no Base64), stats travel in the headers.
+        # Headers must be plain ASCII, so text values are JSON-encoded (emoji -> \uXXXX).
+        return Response(
+            content=jpg.tobytes(),
+            media_type="image/jpeg",
+            headers={
+                "X-Total-Vehicles": str(total),
+                "X-Breakdown": json.dumps(breakdown),
+                "X-Status": json.dumps(status),
+            }
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # ---------------------------------------------------------
-# 🎥 2. VIDEO PREDICTION (Returns Processed Video File)
+# 🎥 2. VIDEO PREDICTION (Shared Frame Pipeline)
 # ---------------------------------------------------------
+# Helper: Downscale so the long side is IMGSZ (keeps aspect ratio, never upscales)
+def shrink_to_imgsz(frame):
+    h, w = frame.shape[:2]
+    scale = IMGSZ / max(h, w)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_LINEAR)
+
+# Pipeline: Yields annotated frames (BGR, shrunk to IMGSZ) from decoded frames (see open_video), in order.
+# Detections of every analysed frame are added into `totals` (one counter per class id).
+def annotate_video(frames_in, conf: float, totals):
+    frame_count = 0
+    frames = []
+    last_result = None
+    frames_in = iter(frames_in)
+    
+    while True:
+        frame = next(frames_in, None)
+        ret = frame is not None
+        if ret:
+            # Shrink ONCE here, so the model (and plot) work on small frames
+            frames.append(shrink_to_imgsz(frame))
+            frame_count += 1
+
+        # Limit for Free Tier Safety (Stop after 10 seconds / ~300 frames)
+        done = not ret or frame_count > 300
+
+        # Run YOLO on a whole batch at once (one call instead of one per frame)
+        if frames and (len(frames) == VIDEO_BATCH_SIZE or done):
+            # Only every Nth frame goes through the model, the rest reuse its boxes
+            first_index = frame_count - len(frames)
+            keyframes = [f for i, f in enumerate(frames, start=first_index) if i % VIDEO_FRAME_SKIP == 0]
+            results = iter(run_model_sync(keyframes, conf=conf, imgsz=IMGSZ, half=HALF, verbose=False) if keyframes else [])
+
+            for i, frame in enumerate(frames, start=first_index):
+                if i % VIDEO_FRAME_SKIP == 0:
+                    last_result = next(results)
+                    totals += count_classes(last_result)
+                # plot(img=...) draws the latest boxes onto THIS frame
+                annotated_frame = last_result.plot(img=frame)
+                yield annotated_frame
+            frames = []
+
+        if done:
+            break
+
+# Helper: Open a video for decoding -> (frame generator, fps, (width, height))
+# PyAV is only worth it on CUDA hosts (GPU decoding); everywhere else OpenCV decodes.
+def open_video(path: str):
+    if av is None or DEVICE != 'cuda':
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError("OpenCV could not open the video.") # Same as PyAV raising on a broken file
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        return read_cv2_frames(cap), int(cap.get(cv2.CAP_PROP_FPS)), size
+
+    container = open_av_container(path)
+    try:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO' # Multi-threaded decoding when it falls back to the CPU
+        fps = int(stream.average_rate or 30)
+        frames = read_av_frames(container, stream)
+        # Decode the first frame now: its UPRIGHT shape is the real output size
+        # (phone videos are often stored sideways + a rotation tag), and a broken file fails here
+        first = next(frames, None)
+    except Exception:
+        container.close()
+        raise
+    if first is None:
+        size = (stream.codec_context.width, stream.codec_context.height)
+    else:
+        size = (first.shape[1], first.shape[0])
+    return prepend_frame(first, frames), fps, size
+
+# Helper: Open with hardware decoding (needs PyAV >= 14), else plain FFmpeg
+def open_av_container(path: str):
+    try:
+        from av.codec.hwaccel import HWAccel
+    except ImportError:
+        return av.open(path)
+    try:
+        return av.open(path, hwaccel=HWAccel(device_type='cuda', allow_software_fallback=True))
+    except av.error.FFmpegError:
+        # FFmpeg could not create the CUDA device (e.g. container without NVDEC libs) -> CPU decoding
+        return av.open(path)
+
+# Helper: Turn a decoded frame upright. PyAV's `rotation` = degrees counterclockwise to display it.
+def rotate_upright(image, rotation: int):
+    rotation = round(rotation / 90) * 90 % 360
+    if rotation == 90:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    if rotation == 180:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if rotation == 270:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    return image
+
+# Frame readers: yield upright BGR NumPy frames and close the source when finished
+def read_av_frames(container, stream):
+    try:
+        for frame in container.decode(stream):
+            yield rotate_upright(frame.to_ndarray(format='bgr24'), getattr(frame, 'rotation', 0))
+    finally:
+        container.close()
+
+# Helper: Put the already-decoded first frame back in front of the rest
+def prepend_frame(first, frames):
+    try:
+        if first is not None:
+            yield first
+        yield from frames
+    finally:
+        frames.close()
+
+def read_cv2_frames(cap):
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+# Helper: Write every annotated frame to an open cv2.VideoWriter of the given (width, height)
+def write_video(frames_in, out, size: tuple, conf: float, totals):
+    for annotated_frame in annotate_video(frames_in, conf, totals):
+        if annotated_frame.shape[:2] != size[::-1]:
+            # Back to the original size so the video writer accepts it
+            annotated_frame = cv2.resize(annotated_frame, size, interpolation=cv2.INTER_LINEAR)
+        out.write(annotated_frame)
+
+# Helper: Open an H.264 writer, on the GPU's NVENC encoder if possible
+def open_video_writer(path: str, fps: int, size: tuple):
+    if DEVICE == 'cuda':
+        # Needs OpenCV built with GStreamer (the pip wheels are not) + the nvcodec plugin
+        pipeline = f"appsrc ! videoconvert ! nvh264enc bitrate=4000 ! h264parse ! mp4mux ! filesink location={path}"
+        out = cv2.VideoWriter(pipeline, cv2.CAP_GSTREAMER, 0, fps, size)
+        if out.isOpened():
+            return out
+    # Fallback: software H.264
+    fourcc = cv2.VideoWriter_fourcc(*'avc1') 
+    return cv2.VideoWriter(path, fourcc, fps, size)
+
+# Helper: Save the upload to a temp .mp4 so OpenCV can open it (on /dev/shm when it fits)
+async def save_upload(file: UploadFile) -> str:
+    if SPOOL_DIR is not None:
+        try:
+            return await run_in_threadpool(write_temp_video, file.file, SPOOL_DIR)
+        except OSError:
+            file.file.seek(0) # /dev/shm is small (64 MB by default in Docker) -> use the normal temp dir
+    return await run_in_threadpool(write_temp_video, file.file, None)
+
+# Helper: Copy a file object in chunks to a new temp .mp4 in `folder`; a half-written file is deleted
+def write_temp_video(source, folder) -> str:
+    input_vid = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4", dir=folder)
+    try:
+        with input_vid:
+            shutil.copyfileobj(source, input_vid)
+    except OSError:
+        os.remove(input_vid.name)
+        raise
+    return input_vid.name
+
+# 🎥 2A. Returns Processed Video File
 @app.post('/predict/video')
 async def predict_video(
     file: UploadFile = File(...), 
     conf: float = Query(0.25),
     username: str = Depends(verify_token)
 ):
-    if "video" not in file.content_type:
+    # Fail fast (before spooling anything); content_type can be None
+    if "video" not in (file.content_type or ""):
         raise HTTPException(status_code=400, detail="File must be a video.")
 
     # Create Temp Input and Output Files
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as input_vid:
-        shutil.copyfileobj(file.file, input_vid)
-        input_path = input_vid.name
-    
-    output_path = input_path.replace(".mp4", "_out.mp4")
+    input_path = await save_upload(file)
 
+    # Open Video (a file we can't read is the client's fault -> 400, not 500)
     try:
-        # Open Video
-        cap = cv2.VideoCapture(input_path)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        
-        # Initialize Video Writer (mp4v codec is widely supported)
-        # NEW (Good for browsers - H.264)
-        fourcc = cv2.VideoWriter_fourcc(*'avc1') 
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        frames_in, fps, size = await run_in_threadpool(open_video, input_path)
+    except Exception:
+        os.remove(input_path)
+        raise HTTPException(status_code=400, detail="Could not read video.")
 
-        frame_count = 0
-        
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Process every frame (Or skip frames if Render is too slow)
-            # plot() draws the boxes directly on the frame
-            results = model.predict(frame, conf=conf, verbose=False)
-            annotated_frame = results[0].plot()
-            
-            out.write(annotated_frame)
-            frame_count += 1
-            
-            # Limit for Free Tier Safety (Stop after 10 seconds / ~300 frames)
-            if frame_count > 300: 
-                break 
+    # Output goes to the normal temp dir: cv2.VideoWriter fails silently on a full /dev/shm
+    with tempfile.NamedTemporaryFile(delete=False, suffix="_out.mp4") as output_vid:
+        output_path = output_vid.name
+
+    try:
+        # Initialize Video Writer (H.264, good for browsers)
+        out = open_video_writer(output_path, fps, size)
+
+        # Decode/draw/encode runs in a worker thread so the event loop keeps serving requests
+        totals = np.zeros(len(model.names), dtype=np.int64)
+        await run_in_threadpool(write_video, frames_in, out, size, conf, totals)
 
-        cap.release()
         out.release()
         
-        # Return the processed video file directly
-        return FileResponse(output_path, media_type="video/mp4", filename="traffic_analysis.mp4")
+        # Return the processed video file directly (detection summary in a header)
+        # and delete it once it has been sent
+        return FileResponse(
+            output_path, media_type="video/mp4", filename="traffic_analysis.mp4",
+            headers={"X-Breakdown": json.dumps(class_breakdown(totals))},
+            background=BackgroundTask(os.remove, output_path)
+        )
 
     except Exception as e:
+        # Don't leave a half-written output behind
+        if os.path.exists(output_path):
+            os.remove(output_path)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # Cleanup input (we keep output for the response, FastAPI cleans temp files usually)
+        # Cleanup input (on success, output is removed after the response is sent)
         if os.path.exists(input_path):
             os.remove(input_path)
 
+# 🎥 2B. Streams Annotated Frames as MJPEG (First frame arrives right away, sent at IMGSZ size)
+@app.post('/predict/video/stream')
+async def predict_video_stream(
+    file: UploadFile = File(...), 
+    conf: float = Query(0.25),
+    username: str = Depends(verify_token)
+):
+    # Fail fast (before spooling anything); content_type can be None
+    if "video" not in (file.content_type or ""):
+        raise HTTPException(status_code=400, detail="File must be a video.")
+
+    input_path = await save_upload(file)
+
+    # Open BEFORE streaming starts, so a broken file gets a proper 400 (not an empty 200)
+    try:
+        frames_in, _, _ = await run_in_threadpool(open_video, input_path)
+    except Exception:
+        os.remove(input_path)
+        raise HTTPException(status_code=400, detail="Could not read video.")
+
+    # Runs while the response is being sent (StreamingResponse pulls one frame at a time, in a worker thread)
+    def mjpeg_frames():
+        totals = np.zeros(len(model.names), dtype=np.int64)
+        try:
+            for annotated_frame in annotate_video(frames_in, conf, totals):
+                ok, jpg = cv2.imencode('.jpg', annotated_frame)
+                if ok:
+                    yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpg.tobytes() + b'\r\n'
+            # Last part: the detection summary, built once from the running totals
+            summary = json.dumps({"breakdown": class_breakdown(totals)}).encode()
+            yield b'--frame\r\nContent-Type: application/json\r\n\r\n' + summary + b'\r\n'
+        finally:
+            # Input is only needed until the last frame is sent
+            frames_in.close()
+            if os.path.exists(input_path):
+                os.remove(input_path)
+
+    return StreamingResponse(mjpeg_frames(), media_type="multipart/x-mixed-replace; boundary=frame")
+
 # ---------------------------------------------------------
 # 🔐 AUTH ENDPOINTS (Kept exactly the same)
 # ---------------------------------------------------------
@@ -150,4 +417,9 @@ def login(user: UserAuth):
         data={'sub': user.username}, 
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
-    return {'access_token': access_token, 'token_type': 'Bearer', 'expires_in': ACCESS_TOKEN_EXPIRE_MINUTES * 60}
\ No newline at end of file
+    return {'access_token': access_token, 'token_type': 'Bearer', 'expires_in': ACCESS_TOKEN_EXPIRE_MINUTES * 60}
+
+# Start: python main.py (keep workers=1 so the model is loaded only once)
+# On CPU, also set OMP_NUM_THREADS=<number of physical cores>
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)), workers=1)